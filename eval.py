@@ -1,18 +1,33 @@
 import asyncio
+import hashlib
+import math
+import os
 import pandas as pd
-from datasets import Dataset
 from tqdm import tqdm
-from ragas import evaluate
-from ragas.metrics import faithfulness, answer_relevancy
+import ragas
+from ragas import RunConfig
+from ragas.dataset_schema import SingleTurnSample
+from ragas.embeddings import embedding_factory
+from ragas.llms import llm_factory
+from ragas.metrics import Faithfulness, AnswerRelevancy
+from ragas.metrics.base import MetricWithEmbeddings, MetricWithLLM, SingleTurnMetric
 import websockets
 import json
 from typing import Dict, List
 
-# Load the DataFrame from the CSV file
-test_df = pd.read_csv("./data/eval_queries/test_queries.csv", index_col=0)
 model = "gpt-4o"
+TEST_QUERIES_FILE = "./data/eval_queries/test_queries.csv"
 OUTPUT_FILE_FULL = f"./data/eval_results/test_queries_results_full-{model}.csv"
 OUTPUT_FILE_REDUCED = f"./data/eval_results/test_queries_results_metrics_only-{model}.csv"
+# Memoized metric scores keyed by judge fingerprint and a content hash of question/response/contexts
+CACHE_FILE = f"./data/eval_cache/ragas_judgments-{model}.json"
+MAX_CONCURRENT_SCORING = 4
+
+# Judge configuration (ragas' own defaults); part of the cache fingerprint
+JUDGE_LLM = "gpt-4o-mini"
+JUDGE_EMBEDDINGS = "text-embedding-ada-002"
+JUDGE_RUN_CONFIG = RunConfig()
+METRIC_CLASSES = [Faithfulness, AnswerRelevancy]
 
 
 async def send_query_for_eval(query: str) -> Dict[str, List[str]]:
@@ -66,70 +81,216 @@ async def generate_response(question: str) -> dict:
     }
 
 
-async def generate_ragas_dataset(test_df: pd.DataFrame) -> Dataset:
-    """Generate a dataset of agent responses and their contexts for evaluation."""
-    test_questions = test_df["query"].values
-    responses = []
-    
-    for question in tqdm(test_questions):
-        response = await generate_response(question)  # Process each question serially
-        responses.append(response)
-    
-    dataset_dict = {
-        "question": test_questions,
-        "response": [response["answer"] for response in responses],  # The agent's responses
-        "contexts": [response["contexts"] for response in responses],  # Store contexts separately for each question
-    }
+def build_metrics() -> List[SingleTurnMetric]:
+    """Create this run's metric instances, wired to the judge LLM and embeddings.
 
-    # Convert to Hugging Face Dataset
-    return Dataset.from_dict(dataset_dict)
+    ragas.evaluate attaches models to (and later clears them from) the shared module-level
+    metric objects, so the streaming scorer uses its own instances instead.
+    """
+    llm = llm_factory(JUDGE_LLM, run_config=JUDGE_RUN_CONFIG)
+    embeddings = embedding_factory(JUDGE_EMBEDDINGS, run_config=JUDGE_RUN_CONFIG)
+    metrics = []
+    for metric_class in METRIC_CLASSES:
+        metric = metric_class()
+        if isinstance(metric, MetricWithLLM):
+            metric.llm = llm
+        if isinstance(metric, MetricWithEmbeddings):
+            metric.embeddings = embeddings
+        metric.init(JUDGE_RUN_CONFIG)
+        metrics.append(metric)
+    return metrics
 
 
-async def evaluate_ragas(test_df: pd.DataFrame):
-    """Generate responses and evaluate using ragas metrics."""
-    # Generate dataset from agent's responses
-    ragas_eval_dataset = await generate_ragas_dataset(test_df.head(15))
+def judge_fingerprint(metric_names: List[str]) -> str:
+    """Hash of everything besides the row itself that determines a judgment."""
+    payload = json.dumps(
+        {
+            "ragas": ragas.__version__,
+            "llm": JUDGE_LLM,
+            "embeddings": JUDGE_EMBEDDINGS,
+            "metrics": sorted(metric_names),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
 
-    # Evaluate using faithfulness and answer relevancy metrics
-    evaluation_result = evaluate(
-        dataset=ragas_eval_dataset,
-        metrics=[faithfulness, answer_relevancy],
+def row_key(question: str, response: str, contexts: List[str]) -> str:
+    """Content hash identifying a question/answer/context triple in the judgment cache."""
+    payload = json.dumps(
+        {"question": question, "response": response, "contexts": contexts},
+        sort_keys=True,
+        ensure_ascii=False,
     )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-    # Convert evaluation results to a DataFrame for easier viewing
-    eval_scores_df = pd.DataFrame(evaluation_result.scores)
-    
-    # Round the evaluation scores to the 3rd significant digit
-    eval_scores_df = eval_scores_df.round(3)
 
-    # Create the reduced DataFrame
-    reduced_df = eval_scores_df.copy()
+def load_cache(path: str, fingerprint: str) -> Dict[str, Dict[str, float]]:
+    """Load the memoized metric scores recorded under the given judge fingerprint."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (json.JSONDecodeError, OSError):
+        print(f"Ignoring unreadable judgment cache: {path}")
+        return {}
+    # Judgments from another judge/metric configuration are dropped on the next save
+    return cache.get(fingerprint, {})
 
-    # Add question, answer, and context columns
-    eval_scores_df["question"] = ragas_eval_dataset["question"]
-    eval_scores_df["response"] = ragas_eval_dataset["response"]
-    eval_scores_df["contexts"] = ragas_eval_dataset["contexts"]
 
-    reduced_df["question"] = ragas_eval_dataset["question"]
-    reduced_df["response"] = ragas_eval_dataset["response"]
+def save_cache(cache: Dict[str, Dict[str, float]], path: str, fingerprint: str):
+    """Atomically persist the judgment cache so an interrupted run keeps its progress."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({fingerprint: cache}, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
 
-    # Add an average row at the end for both DataFrames
-    avg_row_full = eval_scores_df.mean(numeric_only=True).round(3)
-    avg_row_full["question"] = "Average"
-    avg_row_full["response"] = ""
-    avg_row_full["contexts"] = ""
-    eval_scores_df = pd.concat([eval_scores_df, pd.DataFrame([avg_row_full])], ignore_index=True)
 
-    avg_row_reduced = reduced_df.mean(numeric_only=True).round(3)
-    avg_row_reduced["question"] = "Average"
-    reduced_df = pd.concat([reduced_df, pd.DataFrame([avg_row_reduced])], ignore_index=True)
+async def score_row(
+    metrics: List[SingleTurnMetric], question: str, response: str, contexts: List[str]
+) -> Dict[str, float]:
+    """Run the ragas metrics over a single row on the current event loop."""
+    sample = SingleTurnSample(user_input=question, response=response, retrieved_contexts=contexts)
+    scores = await asyncio.gather(*(
+        metric.single_turn_ascore(sample, timeout=JUDGE_RUN_CONFIG.timeout) for metric in metrics
+    ))
+    return {metric.name: float(score) for metric, score in zip(metrics, scores)}
 
-    # Save the full DataFrame with all information (question, response, contexts, faithfulness, answer_relevancy)
-    eval_scores_df.to_csv(OUTPUT_FILE_FULL, index=False)
 
-    # Save the reduced DataFrame (question and response)
-    reduced_df.to_csv(OUTPUT_FILE_REDUCED, index=False)
-    
+class IncrementalResults:
+    """Collect scored rows as they arrive and keep the result CSVs and averages up to date."""
+
+    def __init__(self, metric_names: List[str], full_path: str, reduced_path: str):
+        self.metric_names = metric_names
+        self.full_path = full_path
+        self.reduced_path = reduced_path
+        self.rows: Dict[int, dict] = {}
+
+    def add(self, index: int, question: str, response: str, contexts: List[str], scores: Dict[str, float]):
+        """Record one scored row and rewrite the CSVs."""
+        # Round the evaluation scores to the 3rd decimal, as the averages are taken over these
+        row = {name: round(scores[name], 3) for name in self.metric_names}
+        row.update({"question": question, "response": response, "contexts": contexts})
+        self.rows[index] = row
+        self.write()
+
+    def dataframes(self):
+        """Build the full and reduced DataFrames (in question order) with an average row appended."""
+        eval_scores_df = pd.DataFrame(
+            [self.rows[index] for index in sorted(self.rows)],
+            columns=self.metric_names + ["question", "response", "contexts"],
+        )
+        reduced_df = eval_scores_df.drop(columns=["contexts"])
+
+        # Add an average row at the end for both DataFrames
+        avg_row_full = eval_scores_df[self.metric_names].astype(float).mean().round(3)
+        avg_row_full["question"] = "Average"
+        avg_row_full["response"] = ""
+        avg_row_full["contexts"] = ""
+        eval_scores_df = pd.concat([eval_scores_df, pd.DataFrame([avg_row_full])], ignore_index=True)
+
+        avg_row_reduced = reduced_df[self.metric_names].astype(float).mean().round(3)
+        avg_row_reduced["question"] = "Average"
+        reduced_df = pd.concat([reduced_df, pd.DataFrame([avg_row_reduced])], ignore_index=True)
+        return eval_scores_df, reduced_df
+
+    def write(self):
+        eval_scores_df, reduced_df = self.dataframes()
+        # Save the full DataFrame with all information (question, response, contexts, faithfulness, answer_relevancy)
+        eval_scores_df.to_csv(self.full_path, index=False)
+        # Save the reduced DataFrame (question and response)
+        reduced_df.to_csv(self.reduced_path, index=False)
+
+
+class StreamingScorer:
+    """Score rows in the background as they arrive, reusing cached judgments for unchanged rows."""
+
+    def __init__(
+        self,
+        metrics: List[SingleTurnMetric],
+        results: IncrementalResults,
+        cache_path: str,
+        total: int,
+        max_concurrent_scoring: int = MAX_CONCURRENT_SCORING,
+    ):
+        self.metrics = metrics
+        self.metric_names = [metric.name for metric in metrics]
+        self.results = results
+        self.cache_path = cache_path
+        self.fingerprint = judge_fingerprint(self.metric_names)
+        self.cache = load_cache(cache_path, self.fingerprint)
+        self.semaphore = asyncio.Semaphore(max_concurrent_scoring)
+        self.tasks: List[asyncio.Task] = []
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.progress = tqdm(total=total, desc="Scored")
+
+    def submit(self, index: int, question: str, response: str, contexts: List[str]):
+        """Schedule a row for scoring in the background."""
+        self.tasks.append(asyncio.create_task(self._score(index, question, response, contexts)))
+
+    def is_complete(self, scores) -> bool:
+        """A cached judgment is reused only if it has every metric and none of them is NaN."""
+        return scores is not None and all(
+            name in scores and not math.isnan(scores[name]) for name in self.metric_names
+        )
+
+    async def _score(self, index: int, question: str, response: str, contexts: List[str]):
+        key = row_key(question, response, contexts)
+        scores = self.cache.get(key)
+        if self.is_complete(scores):
+            self.hits += 1
+        else:
+            try:
+                async with self.semaphore:
+                    scores = await score_row(self.metrics, question, response, contexts)
+            except Exception as e:
+                # Like ragas.evaluate, a row that cannot be scored is recorded as NaN
+                tqdm.write(f"Failed to score {question!r}: {e!r}")
+                scores = {name: float("nan") for name in self.metric_names}
+                self.failures += 1
+            else:
+                self.misses += 1
+            # NaN usually means an unparseable judge output, so leave the row to be rescored next run
+            if self.is_complete(scores):
+                self.cache[key] = scores
+                save_cache(self.cache, self.cache_path, self.fingerprint)
+        self.results.add(index, question, response, contexts, scores)
+        self.progress.set_postfix(cached=self.hits, scored=self.misses, failed=self.failures)
+        self.progress.update(1)
+
+    async def wait(self):
+        """Wait for every submitted row to be scored."""
+        await asyncio.gather(*self.tasks)
+
+    async def close(self):
+        """Cancel rows still in flight (if the agent loop failed) and release the progress bar."""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.progress.close()
+
+
+async def evaluate_ragas(test_df: pd.DataFrame, max_concurrent_scoring: int = MAX_CONCURRENT_SCORING):
+    """Stream agent responses into ragas scoring, scoring each answer as soon as it arrives."""
+    test_questions = test_df["query"].head(15).tolist()
+    metrics = build_metrics()
+    results = IncrementalResults([metric.name for metric in metrics], OUTPUT_FILE_FULL, OUTPUT_FILE_REDUCED)
+    scorer = StreamingScorer(metrics, results, CACHE_FILE, len(test_questions), max_concurrent_scoring)
+
+    try:
+        # Query the agent serially, handing each answer to the scorers immediately
+        for index, question in enumerate(test_questions):
+            response = await generate_response(question)
+            scorer.submit(index, question, response["answer"], response["contexts"])
+        await scorer.wait()
+    finally:
+        await scorer.close()
+
+    eval_scores_df, reduced_df = results.dataframes()
     print("Evaluation Results (Full):")
     print(eval_scores_df)
     print("Evaluation Results (Reduced):")
@@ -137,6 +298,9 @@ async def evaluate_ragas(test_df: pd.DataFrame):
 
 
 if __name__ == "__main__":
+    # Load the DataFrame from the CSV file
+    test_df = pd.read_csv(TEST_QUERIES_FILE, index_col=0)
+
     # Run the evaluation loop
     asyncio.run(evaluate_ragas(test_df))
 
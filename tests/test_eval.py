@@ -0,0 +1,132 @@
+import asyncio
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+import eval as eval_pipeline
+
+METRIC_NAMES = ["faithfulness", "answer_relevancy"]
+
+
+@pytest.fixture
+def pipeline(monkeypatch, tmp_path):
+    """Point the eval pipeline at temporary files and a fake agent/judge."""
+    monkeypatch.setattr(eval_pipeline, "CACHE_FILE", str(tmp_path / "cache" / "judgments.json"))
+    monkeypatch.setattr(eval_pipeline, "OUTPUT_FILE_FULL", str(tmp_path / "full.csv"))
+    monkeypatch.setattr(eval_pipeline, "OUTPUT_FILE_REDUCED", str(tmp_path / "reduced.csv"))
+    monkeypatch.setattr(
+        eval_pipeline, "build_metrics", lambda: [SimpleNamespace(name=name) for name in METRIC_NAMES]
+    )
+
+    async def fake_generate_response(question):
+        return {"answer": f"answer to {question}", "contexts": [f"context for {question}"]}
+
+    monkeypatch.setattr(eval_pipeline, "generate_response", fake_generate_response)
+    return tmp_path
+
+
+def test_row_key_is_content_hash():
+    key = eval_pipeline.row_key("q", "a", ["c1", "c2"])
+
+    assert key == eval_pipeline.row_key("q", "a", ["c1", "c2"])
+    assert key != eval_pipeline.row_key("q2", "a", ["c1", "c2"])
+    assert key != eval_pipeline.row_key("q", "a2", ["c1", "c2"])
+    assert key != eval_pipeline.row_key("q", "a", ["c1"])
+
+
+def test_cache_round_trip(tmp_path):
+    path = str(tmp_path / "cache" / "judgments.json")
+    fingerprint = eval_pipeline.judge_fingerprint(METRIC_NAMES)
+    cache = {"abc": {"faithfulness": 0.5, "answer_relevancy": 0.25}}
+
+    eval_pipeline.save_cache(cache, path, fingerprint)
+
+    assert eval_pipeline.load_cache(path, fingerprint) == cache
+    # Judgments recorded under another judge configuration are not reused
+    assert eval_pipeline.load_cache(path, eval_pipeline.judge_fingerprint(["faithfulness"])) == {}
+
+
+def test_nan_scores_are_not_cached(pipeline, monkeypatch):
+    calls = []
+
+    async def flaky_score_row(metrics, question, response, contexts):
+        calls.append(question)
+        # The judge output could not be parsed on the first attempt
+        answer_relevancy = float("nan") if len(calls) == 1 else 0.5
+        return {"faithfulness": 1.0, "answer_relevancy": answer_relevancy}
+
+    monkeypatch.setattr(eval_pipeline, "score_row", flaky_score_row)
+    test_df = pd.DataFrame({"query": ["q1"]})
+    fingerprint = eval_pipeline.judge_fingerprint(METRIC_NAMES)
+
+    asyncio.run(eval_pipeline.evaluate_ragas(test_df))
+    assert eval_pipeline.load_cache(eval_pipeline.CACHE_FILE, fingerprint) == {}
+
+    asyncio.run(eval_pipeline.evaluate_ragas(test_df))
+    assert calls == ["q1", "q1"]
+    assert list(eval_pipeline.load_cache(eval_pipeline.CACHE_FILE, fingerprint).values()) == [
+        {"faithfulness": 1.0, "answer_relevancy": 0.5}
+    ]
+
+
+def test_cache_hit_skips_scoring(pipeline, monkeypatch):
+    calls = []
+
+    async def fake_score_row(metrics, question, response, contexts):
+        calls.append(question)
+        return {"faithfulness": 1.0, "answer_relevancy": 0.5}
+
+    monkeypatch.setattr(eval_pipeline, "score_row", fake_score_row)
+    test_df = pd.DataFrame({"query": ["q1", "q2"]})
+
+    asyncio.run(eval_pipeline.evaluate_ragas(test_df))
+    assert calls == ["q1", "q2"]
+
+    asyncio.run(eval_pipeline.evaluate_ragas(test_df))
+    assert calls == ["q1", "q2"]
+
+    asyncio.run(eval_pipeline.evaluate_ragas(pd.DataFrame({"query": ["q1", "q3"]})))
+    assert calls == ["q1", "q2", "q3"]
+
+
+def test_scoring_error_records_nan(pipeline, monkeypatch):
+    async def score_row(metrics, question, response, contexts):
+        if question == "q1":
+            raise RuntimeError("judge unavailable")
+        return {"faithfulness": 1.0, "answer_relevancy": 0.5}
+
+    monkeypatch.setattr(eval_pipeline, "score_row", score_row)
+    test_df = pd.DataFrame({"query": ["q0", "q1", "q2"]})
+
+    asyncio.run(eval_pipeline.evaluate_ragas(test_df, max_concurrent_scoring=1))
+
+    full_df = pd.read_csv(eval_pipeline.OUTPUT_FILE_FULL)
+    assert full_df["question"].tolist() == ["q0", "q1", "q2", "Average"]
+    assert full_df["faithfulness"].isna().tolist() == [False, True, False, False]
+    assert full_df["faithfulness"].tolist()[-1] == 1.0
+
+    cache = eval_pipeline.load_cache(eval_pipeline.CACHE_FILE, eval_pipeline.judge_fingerprint(METRIC_NAMES))
+    assert eval_pipeline.row_key("q1", "answer to q1", ["context for q1"]) not in cache
+    assert eval_pipeline.row_key("q0", "answer to q0", ["context for q0"]) in cache
+    assert eval_pipeline.row_key("q2", "answer to q2", ["context for q2"]) in cache
+
+
+def test_incremental_results_order_and_average(tmp_path):
+    full_path = tmp_path / "full.csv"
+    reduced_path = tmp_path / "reduced.csv"
+    results = eval_pipeline.IncrementalResults(METRIC_NAMES, str(full_path), str(reduced_path))
+
+    results.add(1, "q1", "a1", ["c1"], {"faithfulness": 0.0004, "answer_relevancy": 0.5})
+    results.add(0, "q0", "a0", ["c0"], {"faithfulness": 1.0, "answer_relevancy": float("nan")})
+
+    full_df = pd.read_csv(full_path)
+    reduced_df = pd.read_csv(reduced_path)
+
+    assert full_df["question"].tolist() == ["q0", "q1", "Average"]
+    assert reduced_df["question"].tolist() == ["q0", "q1", "Average"]
+    assert "contexts" not in reduced_df.columns
+    # The average is taken over the rounded per-row scores, skipping NaN
+    assert full_df["faithfulness"].tolist() == [1.0, 0.0, 0.5]
+    assert full_df["answer_relevancy"].iloc[-1] == 0.5
+    assert reduced_df["faithfulness"].iloc[-1] == 0.5